@@ -23,9 +23,9 @@ e2_rs_initiate_default() {
     rs.initiate({
     _id: "rs0",
     members: [
-        {_id: 0, host: "mongo1:27017", priority: 1},
-        {_id: 1, host: "mongo2:27018", priority: 0.5},
-        {_id: 2, host: "mongo3:27019", priority: 0.5}
+        {_id: 0, host: "mongo1:27017", priority: 1, tags: {nodeId: "mongo1"}},
+        {_id: 1, host: "mongo2:27018", priority: 0.5, tags: {nodeId: "mongo2"}},
+        {_id: 2, host: "mongo3:27019", priority: 0.5, tags: {nodeId: "mongo3"}}
     ],
     settings: {
         chainingAllowed: false,
@@ -41,9 +41,9 @@ e2_rs_initiate_slow_election_detection() {
     rs.initiate({
     _id: "rs0",
     members: [
-        {_id: 0, host: "mongo1:27017", priority: 1},
-        {_id: 1, host: "mongo2:27018", priority: 0.5},
-        {_id: 2, host: "mongo3:27019", priority: 0.5}
+        {_id: 0, host: "mongo1:27017", priority: 1, tags: {nodeId: "mongo1"}},
+        {_id: 1, host: "mongo2:27018", priority: 0.5, tags: {nodeId: "mongo2"}},
+        {_id: 2, host: "mongo3:27019", priority: 0.5, tags: {nodeId: "mongo3"}}
     ],
     settings: {
         chainingAllowed: false,
@@ -54,6 +54,17 @@ e2_rs_initiate_slow_election_detection() {
     })'
 }
 
+# Adds the nodeId member tags to a replica set initiated without them;
+# run while mongo1 is primary, as rs.reconfig must go to the primary
+e2_rs_tag_members() {
+    docker exec mongo1 mongosh --port 27017 --eval '
+    cfg = rs.conf();
+    cfg.members.forEach(m => {
+        m.tags = Object.assign(m.tags || {}, {nodeId: m.host.split(":")[0]});
+    });
+    rs.reconfig(cfg)'
+}
+
 e2_rs_monitor() {
     read node port < <(validate_mongo_node "$1")
     echo "Status on ${node} port ${port}:"
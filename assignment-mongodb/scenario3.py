@@ -1,12 +1,15 @@
 import argparse
+import atexit
 import logging
 import time
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import lru_cache
 import random
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, NamedTuple
 import json
 from pymongo import MongoClient, WriteConcern, ReadPreference
 from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import Nearest
 from pymongo.errors import PyMongoError
 from pymongo.collection import Collection
 
@@ -20,6 +23,9 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logging.getLogger('pymongo.connection').setLevel(logging.INFO)
 
+# Connections kept per server; scenario operations run one at a time
+MAX_POOL_SIZE = 10
+
 
 class MongoClientFactory:
     """Factory class for creating different types of MongoDB clients"""
@@ -30,13 +36,16 @@ class MongoClientFactory:
             base_config = {
                 "serverSelectionTimeoutMS": kwargs.get("serverSelectionTimeoutMS", 5000),
                 "retryWrites": kwargs.get("retryWrites", False),
-                "connectTimeoutMS": kwargs.get("connectTimeoutMS", 5000)
+                "connectTimeoutMS": kwargs.get("connectTimeoutMS", 5000),
+                "maxPoolSize": kwargs.get("maxPoolSize", MAX_POOL_SIZE)
             }
 
             if client_type == "replica":
                 config = {
                     **base_config,
-                    "replicaSet": kwargs.get("replicaSet", "rs0")
+                    "replicaSet": kwargs.get("replicaSet", "rs0"),
+                    "readPreference": kwargs.get("readPreference", "primary"),
+                    "localThresholdMS": kwargs.get("localThresholdMS", 15)
                 }
             elif client_type == "direct":
                 config = {
@@ -66,8 +75,31 @@ class MongoWriter:
         self.client = client
         self.db = self.client[db_name]
         self.collection_name = collection_name
+        self._collections: Dict[tuple, Collection] = {}
         logger.info("MongoDB writer initialized successfully")
 
+    def _get_collection(self, w: str, wtimeout: int, j: bool) -> Collection:
+        """Return the collection handle for a write concern, creating it once"""
+        key = (w, wtimeout, j)
+        collection = self._collections.get(key)
+        if collection is None:
+            collection = self.db.get_collection(
+                self.collection_name,
+                write_concern=WriteConcern(w=w, wtimeout=wtimeout, j=j)
+            )
+            self._collections[key] = collection
+        return collection
+
+    @staticmethod
+    def _journaling_enabled(w: str) -> bool:
+        """Unacknowledged writes (w=0) cannot request journaling"""
+        try:
+            if int(w) == 0:
+                return False
+        except (ValueError, AttributeError):
+            pass
+        return True
+
     def drop(self):
         """Drop the collection"""
         try:
@@ -82,21 +114,11 @@ class MongoWriter:
                        wtimeout: int = 5000) -> float:
 
         try:
-            enable_journaling = True
-            try:
-                if int(w) == 0:
-                    enable_journaling = False
-            except (ValueError, AttributeError):
-                pass
-
-            collection: Collection = self.db.get_collection(
-                self.collection_name,
-                write_concern=WriteConcern(
-                    w=w, wtimeout=wtimeout, j=enable_journaling)
-            )
+            collection: Collection = self._get_collection(
+                w, wtimeout, self._journaling_enabled(w))
 
             document = {
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
                 "data": data
             }
 
@@ -116,34 +138,76 @@ class MongoWriter:
                 "Error during write - WriteConcern: w={0} | Error: {1}".format(w, str(e)))
             return -1.0
 
+    def write_documents_batch(self, values: List[Any], w: str = "majority",
+                              wtimeout: int = 5000) -> float:
+        """Insert all values in one unordered insert_many round-trip"""
+
+        try:
+            collection: Collection = self._get_collection(
+                w, wtimeout, self._journaling_enabled(w))
+
+            timestamp = datetime.now(timezone.utc).isoformat()
+            documents = [{"timestamp": timestamp, "data": value}
+                         for value in values]
+
+            start_time = time.time()
+            result = collection.insert_many(documents, ordered=False)
+            duration = round((time.time() - start_time) * 1000, 2)
+
+            logger.info(
+                "Batch write succeeded - WriteConcern: w={0} | "
+                "Duration: {1:8.2f}ms | "
+                "Documents: {2}".format(w, duration, len(result.inserted_ids))
+            )
+            return duration
+
+        except PyMongoError as e:
+            logger.error(
+                "Error during batch write - WriteConcern: w={0} | Error: {1}".format(w, str(e)))
+            return -1.0
+
 
 class MongoReader:
-    def __init__(self, name, client: MongoClient, db_name: str, collection_name: str):
+    def __init__(self, name, client: MongoClient, db_name: str, collection_name: str,
+                 read_preference: ReadPreference = ReadPreference.SECONDARY_PREFERRED):
         self.name = name
         self.client = client
         self.db = self.client[db_name]
         self.collection_name = collection_name
+        self.read_preference = read_preference
         logger.info("MongoDB reader initialized successfully")
 
     def read_documents(self,
                        read_concern: str = "local",
-                       read_preference: ReadPreference = ReadPreference.PRIMARY,
+                       read_preference: Optional[ReadPreference] = None,
                        query: Dict[str, Any] = None,
-                       limit: Optional[int] = 1000) -> float:
+                       limit: Optional[int] = 1000,
+                       batch_size: Optional[int] = None) -> float:
         try:
 
+            read_preference = read_preference or self.read_preference
             collection: Collection = self.db.get_collection(
                 self.collection_name,
+                read_preference=read_preference,
                 read_concern=ReadConcern(read_concern)
             )
 
             query = query or {}
-            start_time = time.time()
-            cursor = collection.find(query)
-            if limit:
-                cursor = cursor.limit(limit)
+            # With a limit, ask for it as a single batch to save getMore round-trips
+            batch_size = batch_size or limit or 0
+            dump_documents = logger.isEnabledFor(logging.DEBUG)
 
-            documents = list(cursor)
+            start_time = time.time()
+            cursor = collection.find(query, limit=limit or 0,
+                                     batch_size=batch_size)
+
+            # Stream the cursor; only keep the documents when they get logged
+            count = 0
+            documents = []
+            for document in cursor:
+                count += 1
+                if dump_documents:
+                    documents.append(document)
             duration = round((time.time() - start_time) * 1000, 2)
 
             logger.info(
@@ -151,11 +215,12 @@ class MongoReader:
                 "Read concern {1} | "
                 "Duration: {2:8.2f}ms | "
                 "Documents: {3}".format(
-                    self.name, read_concern, duration, len(documents))
+                    self.name, read_concern, duration, count)
             )
 
-            logger.info("{0}".format(json.dumps(documents, indent=2,
-                                                default=str, ensure_ascii=False)))
+            if dump_documents:
+                logger.debug("{0}".format(json.dumps(documents, indent=2,
+                                                     default=str, ensure_ascii=False)))
             return duration
 
         except PyMongoError as e:
@@ -171,6 +236,12 @@ def parse_args():
         action='store_true',
         help='Write a document with random value to collection'
     )
+    parser.add_argument(
+        '--write-count',
+        type=int,
+        default=1,
+        help='Number of random values to write; more than one uses a single batch write'
+    )
     parser.add_argument(
         '--read',
         action='store_true',
@@ -181,43 +252,102 @@ def parse_args():
         action='store_true',
         help='Drop the collection'
     )
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        help='Log the documents returned by reads'
+    )
     return parser.parse_args()
 
 
-def create_clients():
+# containers are reachable from the host via the published ports —
+# use localhost when running this script on the host machine.
+MONGODB_RS_URI = "mongodb://localhost:27017,localhost:27018,localhost:27019/"
+MONGODB_NODE_URIS = {
+    "mongo1": "mongodb://localhost:27017/",
+    "mongo2": "mongodb://localhost:27018/",
+    "mongo3": "mongodb://localhost:27019/",
+}
 
-    # containers are reachable from the host via the published ports —
-    # use localhost when running this script on the host machine.
-    MONGODB_RS_URI = "mongodb://localhost:27017,localhost:27018,localhost:27019/"
-    MONGODB1_URI = "mongodb://localhost:27017/"
-    MONGODB2_URI = "mongodb://localhost:27018/"
-    MONGODB3_URI = "mongodb://localhost:27019/"
 
-    client_mongo1_direct = MongoClientFactory.create_client(
-        "direct",
-        MONGODB1_URI
-    )
+class MongoClients(NamedTuple):
+    replicaset: MongoClient
+    # Per-node clients, only created when the replica-set client is unavailable
+    direct: Dict[str, MongoClient]
 
-    client_mongo2_direct = MongoClientFactory.create_client(
-        "direct",
-        MONGODB2_URI
-    )
 
-    client_mongo3_direct = MongoClientFactory.create_client(
-        "direct",
-        MONGODB3_URI
-    )
+def members_tagged(client: MongoClient) -> bool:
+    """Check that every node carries the nodeId tag the readers select on"""
+    config = client.admin.command("replSetGetConfig")["config"]
+    node_ids = {member.get("tags", {}).get("nodeId")
+                for member in config["members"]}
+    return node_ids.issuperset(MONGODB_NODE_URIS)
 
+
+@lru_cache(maxsize=None)
+def get_clients() -> MongoClients:
+    """Create the scenario clients once and reuse them for later calls"""
+
+    client_replicaset = None
     try:
+        # Reads target individual nodes through the nodeId member tags,
+        # so one client and pool covers all three nodes
         client_replicaset = MongoClientFactory.create_client(
             "replica",
-            MONGODB_RS_URI
+            MONGODB_RS_URI,
+            readPreference="nearest",
+            localThresholdMS=15
         )
+        if members_tagged(client_replicaset):
+            return MongoClients(client_replicaset, {})
+        # A set initiated before the tags were added keeps its old config;
+        # tagged reads would only time out against it
+        logger.warning("Replica-set members lack nodeId tags (see e2_rs_tag_members); "
+                       "reading through direct clients")
     except Exception:
-        logger.warning("Replica-set client unavailable from host; falling back to primary direct client")
-        client_replicaset = client_mongo1_direct
-
-    return client_mongo1_direct, client_mongo2_direct, client_mongo3_direct, client_replicaset
+        logger.warning("Replica-set client unavailable from host; falling back to direct clients")
+
+    # A direct connection has a single candidate server, so there is
+    # nothing to wait for during server selection
+    direct = {
+        node: MongoClientFactory.create_client(
+            "direct",
+            uri,
+            serverSelectionTimeoutMS=1000
+        )
+        for node, uri in MONGODB_NODE_URIS.items()
+    }
+    # Writes still go through the replica-set client when it connected
+    return MongoClients(client_replicaset or direct["mongo1"], direct)
+
+
+def create_readers(clients: MongoClients, db_name: str,
+                   collection_name: str) -> List["MongoReader"]:
+    """One reader per node, pinned by member tag or by direct connection"""
+    if clients.direct:
+        return [
+            MongoReader("client_{0}_direct".format(node), client,
+                        db_name, collection_name)
+            for node, client in clients.direct.items()
+        ]
+    return [
+        MongoReader("client_{0}_tagged".format(node), clients.replicaset,
+                    db_name, collection_name,
+                    read_preference=Nearest(tag_sets=[{"nodeId": node}]))
+        for node in MONGODB_NODE_URIS
+    ]
+
+
+@atexit.register
+def close_clients():
+    """Close the cached clients, if any were created"""
+    if get_clients.cache_info().currsize == 0:
+        return
+    clients = get_clients()
+    clients.replicaset.close()
+    for client in clients.direct.values():
+        client.close()
+    get_clients.cache_clear()
 
 
 def scenario3():
@@ -228,21 +358,17 @@ def scenario3():
     read_concerns = ["local", "majority", "linearizable"]
 
     args = parse_args()
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
     try:
 
-        client_mongo1_direct, client_mongo2_direct, client_mongo3_direct, client_replicaset = create_clients()
+        clients = get_clients()
 
         # Initialize writer and reader with the same client
-        writer = MongoWriter(client_replicaset, DB_NAME, COLLECTION_NAME)
-
-        readers = [
-            MongoReader("client_mongo1_direct", client_mongo1_direct,
-                        DB_NAME, COLLECTION_NAME),
-            MongoReader("client_mongo2_direct", client_mongo2_direct,
-                        DB_NAME, COLLECTION_NAME),
-            MongoReader("client_mongo3_direct", client_mongo3_direct,
-                        DB_NAME, COLLECTION_NAME)
-        ]
+        writer = MongoWriter(clients.replicaset, DB_NAME, COLLECTION_NAME)
+
+        readers = create_readers(clients, DB_NAME, COLLECTION_NAME)
 
         try:
 
@@ -252,9 +378,15 @@ def scenario3():
 
             if args.write:
                 logger.info("Writing random values to collection...")
-                data = random.randint(1, 1000)
-                logger.info("Writing value %s", data)
-                duration = writer.write_document(data, w=3)
+                if args.write_count > 1:
+                    values = [random.randint(1, 1000)
+                              for _ in range(args.write_count)]
+                    logger.info("Writing %d values", len(values))
+                    duration = writer.write_documents_batch(values, w=3)
+                else:
+                    data = random.randint(1, 1000)
+                    logger.info("Writing value %s", data)
+                    duration = writer.write_document(data, w=3)
 
             if args.read:
                 logger.info("Reading collection...")
@@ -266,10 +398,7 @@ def scenario3():
 
     except KeyboardInterrupt:
         logger.info("Shutting down...")
-        client_mongo1_direct.close()
-        client_mongo2_direct.close()
-        client_mongo3_direct.close()
-        client_replicaset.close()
+        close_clients()
         logger.info("Cleanup complete")
 
 
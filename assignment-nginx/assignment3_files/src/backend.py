@@ -1,15 +1,67 @@
 from fastapi import FastAPI, Response, Query
 from prometheus_client import Counter, generate_latest, CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, REGISTRY
-from typing import Optional, List
+from prometheus_client.core import CounterMetricFamily
+from typing import Optional, List, TypedDict
+from collections import OrderedDict
 import random
 import asyncio
 import re
 import os
+import time
 app = FastAPI()
 
+# Read once at startup; the environment does not change while running
+MAX_SLEEP = (int(os.environ['DO_ENDPOINT_MAX_LATENCY'])
+             if 'DO_ENDPOINT_MAX_LATENCY' in os.environ else None)
+
+# Filtered registries and their rendered output, keyed by
+# (names, match, _CACHE_VERSION); /reset bumps the version. The keys come
+# from client query strings, so both are LRUs capped at METRICS_CACHE_SIZE
+_REGISTRY_CACHE: OrderedDict[tuple, CollectorRegistry] = OrderedDict()
+_OUTPUT_CACHE: OrderedDict[tuple, tuple[float, bytes]] = OrderedDict()
+_CACHE_VERSION = 0
+METRICS_CACHE_SIZE = 64
+
+# Scrapes within this many seconds get the same rendered output
+METRICS_OUTPUT_TTL = 1.0
+
+# The health check body never changes, so encode it once
+HEALTH_RESPONSE = Response(content=b'{"status":"ok"}',
+                           media_type="application/json")
+
+
+def cache_put(cache: OrderedDict, key, value):
+    # Insert as most recently used, evicting the least recently used entry
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > METRICS_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+class RequestCounter:
+    """Lock-free request counter, exported as a Prometheus counter on scrape.
+
+    Handlers all run on the event loop thread, so a plain int is enough;
+    prometheus_client's Counter takes a lock on every inc().
+    """
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+        REGISTRY.register(self)
+
+    def inc(self):
+        self.value += 1
+
+    def collect(self):
+        yield CounterMetricFamily(self.name, self.documentation,
+                                  value=self.value)
+
+
 # Define metrics
-health_requests = Counter('health_endpoint_requests_total',
-                          'Total requests to health endpoint')
+health_requests = RequestCounter('health_endpoint_requests',
+                                 'Total requests to health endpoint')
 do_requests = Counter('do_endpoint_requests_total',
                       'Total requests to do endpoint')
 
@@ -17,16 +69,22 @@ do_requests = Counter('do_endpoint_requests_total',
 @app.get("/health")
 async def health():
     health_requests.inc()
-    return {"status": "ok"}
+    return HEALTH_RESPONSE
 
 
-@app.get("/do")
-async def do_something():
-    max_sleep_duration = os.getenv('DO_ENDPOINT_MAX_LATENCY')
+class DoResponse(TypedDict):
+    message: str
+    sleep_duration: float
+    data: str
+
 
+# The declared return type lets FastAPI serialize straight to JSON bytes
+# through Pydantic instead of building a dict and calling json.dumps
+@app.get("/do")
+async def do_something() -> DoResponse:
     sleep_duration = 0
-    if max_sleep_duration is not None:
-        sleep_duration = random.uniform(200, int(max_sleep_duration))
+    if MAX_SLEEP is not None:
+        sleep_duration = random.random() * (MAX_SLEEP - 200) + 200
         await asyncio.sleep(sleep_duration/1000)
 
     do_requests.inc()
@@ -40,49 +98,79 @@ async def do_something():
 @app.get("/reset")
 async def reset():
 
-    global health_requests, do_requests
+    global health_requests, do_requests, _CACHE_VERSION
 
     # Unregister individual metrics
     REGISTRY.unregister(health_requests)
     REGISTRY.unregister(do_requests)
 
     # Then recreate them
-    health_requests = Counter('health_endpoint_requests_total',
-                              'Total requests to health endpoint')
+    health_requests = RequestCounter('health_endpoint_requests',
+                                     'Total requests to health endpoint')
     do_requests = Counter('do_endpoint_requests_total',
                           'Total requests to do endpoint')
 
+    # Cached registries still reference the unregistered collectors
+    _CACHE_VERSION += 1
+    _REGISTRY_CACHE.clear()
+    _OUTPUT_CACHE.clear()
+
     return {"reset": "ok"}
 
 
-@app.get("/metrics")
-async def metrics(
-    names: Optional[List[str]] = Query(
-        None, description="List of metric names to include"),
-    match: Optional[str] = Query(
-        None, description="Regex pattern to match metric names")
-):
+def filtered_registry(names: tuple, match: Optional[str]) -> CollectorRegistry:
     # Create a new registry
     registry = CollectorRegistry()
 
+    name_set = frozenset(names) if names else None
+    pattern = re.compile(match) if match else None
+
     # Get all metrics from the default registry
     collectors = list(REGISTRY._collector_to_names.items())
 
     for collector, collector_names in collectors:
         # Filter based on provided names
-        if names and not any(name in names for name in collector_names):
+        if name_set is not None and name_set.isdisjoint(collector_names):
             continue
 
         # Filter based on regex pattern
-        if match and not any(re.search(match, name) for name in collector_names):
+        if pattern is not None and not any(map(pattern.search, collector_names)):
             continue
 
         # Register the collector in our new registry
         registry.register(collector)
 
+    return registry
+
+
+@app.get("/metrics")
+async def metrics(
+    names: Optional[List[str]] = Query(
+        None, description="List of metric names to include"),
+    match: Optional[str] = Query(
+        None, description="Regex pattern to match metric names")
+):
+    key = (tuple(sorted(set(names or ()))), match, _CACHE_VERSION)
+    now = time.monotonic()
+
+    cached = _OUTPUT_CACHE.get(key)
+    if cached is not None and now - cached[0] < METRICS_OUTPUT_TTL:
+        return Response(cached[1], media_type=CONTENT_TYPE_LATEST)
+
+    # Collectors only change on /reset, so reuse the filtered registry
+    registry = _REGISTRY_CACHE.get(key)
+    if registry is None:
+        registry = filtered_registry(key[0], match)
+    cache_put(_REGISTRY_CACHE, key, registry)
+
     # Generate metrics from our filtered registry
-    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    output = generate_latest(registry)
+    cache_put(_OUTPUT_CACHE, key, (now, output))
+    return Response(output, media_type=CONTENT_TYPE_LATEST)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=80)
+    # Single worker: the Prometheus counters live in this process, so extra
+    # workers would each report and /reset only their own share
+    uvicorn.run(app, host="0.0.0.0", port=80,
+                loop="uvloop", http="httptools", access_log=False)
@@ -1,43 +1,135 @@
 import argparse
 import json
-import statistics
+import os
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import time
 
+import numpy as np
+import orjson
 from google.cloud import pubsub_v1
 
 DEFAULT_PROJECT_ID: str = "networkedapps-danila-2026"
 DEFAULT_SUBSCRIPTION_ID: str = "consumer-group-1"
 DEFAULT_CONSUMER_ID: str = "consumer-1"
+DEFAULT_REPORT_INTERVAL: float = 5.0
+
+# Never fewer than the client's default scheduler (10 threads), so small
+# VMs do not lose callback concurrency, e.g. for the sleeping slow-consumer
+CALLBACK_WORKERS: int = max(10, (os.cpu_count() or 1) * 2)
+
+
+_EPOCH: datetime = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_INITIAL_CAPACITY: int = 1024
+
+
+def _to_ns(dt: datetime) -> int:
+    """Convert an aware datetime to integer nanoseconds since the epoch."""
+    return (dt - _EPOCH) // timedelta(microseconds=1) * 1000
+
+
+def _from_ns(ns: int) -> datetime:
+    """Convert integer nanoseconds since the epoch to an aware datetime."""
+    return _EPOCH + timedelta(microseconds=int(ns) // 1000)
+
+
+class _ThreadSamples:
+    """Growable numpy sample buffers owned by a single callback thread.
+
+    Only the owning thread writes; n is bumped after the sample is stored,
+    so other threads can read the first n entries without locking.
+    """
+
+    __slots__ = ("n", "failed", "lat", "rx", "tx", "counts")
+
+    def __init__(self) -> None:
+        self.n: int = 0
+        self.failed: int = 0
+        self.lat: np.ndarray = np.empty(_INITIAL_CAPACITY, dtype=np.int64)
+        self.rx: np.ndarray = np.empty(_INITIAL_CAPACITY, dtype=np.int64)
+        self.tx: np.ndarray = np.empty(_INITIAL_CAPACITY, dtype=np.int64)
+        self.counts: np.ndarray = np.empty(_INITIAL_CAPACITY, dtype=np.int64)
+
+    def append(
+        self, latency_ns: int, receive_ns: int, publish_ns: int, message_count: int
+    ) -> None:
+        n = self.n
+        if n == len(self.lat):
+            capacity = 2 * n
+            self.lat = np.resize(self.lat, capacity)
+            self.rx = np.resize(self.rx, capacity)
+            self.tx = np.resize(self.tx, capacity)
+            self.counts = np.resize(self.counts, capacity)
+        self.lat[n] = latency_ns
+        self.rx[n] = receive_ns
+        self.tx[n] = publish_ns
+        self.counts[n] = message_count
+        self.n = n + 1
 
 
 @dataclass
 class ConsumerMetrics:
-    """Thread-safe metrics collector for consumer statistics."""
+    """Metrics collector for consumer statistics.
+
+    Each callback thread records into its own numpy buffers without taking
+    a lock; finalize() concatenates them for the summary and export.
+    """
 
     _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    # Per-callback-thread buffers; the lock is only taken to register one
+    _local: threading.local = field(default_factory=threading.local, repr=False)
+    _thread_samples: list[_ThreadSamples] = field(default_factory=list, repr=False)
+
     start_time: datetime | None = None
     end_time: datetime | None = None
 
-    # Message tracking
-    messages_received: int = 0
-    messages_failed: int = 0
+    # Merged samples, filled in by finalize()
+    _n: int = field(default=0, repr=False)
+    _failed: int = field(default=0, repr=False)
 
-    # Latency tracking (end-to-end: publish timestamp -> consumer receive time)
-    latencies_ms: list[float] = field(default_factory=list)
+    # Latency tracking in nanoseconds (end-to-end: publish -> consumer receive)
+    _lat: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.int64), repr=False
+    )
 
-    # Timing tracking
-    receive_times: list[datetime] = field(default_factory=list)
-    publish_times: list[datetime] = field(default_factory=list)
+    # Timing tracking, as nanoseconds since the epoch
+    _rx: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.int64), repr=False
+    )
+    _tx: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.int64), repr=False
+    )
 
     # Message sequence tracking (to detect out-of-order delivery)
-    message_counts: list[int] = field(default_factory=list)
-    
+    _counts: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.int64), repr=False
+    )
+
+    # Live totals while running; after finalize() the merged snapshot, so
+    # the counts always match the samples the statistics are computed from
+
+    @property
+    def messages_received(self) -> int:
+        if self.end_time is not None:
+            return self._n
+        return sum(samples.n for samples in self._thread_samples)
+
+    @property
+    def messages_failed(self) -> int:
+        if self.end_time is not None:
+            return self._failed
+        return sum(samples.failed for samples in self._thread_samples)
+
     def to_dict(self, consumer_id: str) -> dict:
         """Export raw metrics and summary data for JSON serialization."""
         with self._lock:
+            n = self._n
+            latencies = self._latencies_ms()
+            sorted_latencies = np.sort(latencies)
+            p50, p95, p99 = self._calculate_percentiles(sorted_latencies, [50, 95, 99])
             return {
                 "consumer_id": consumer_id,
                 "messages_received": self.messages_received,
@@ -46,85 +138,101 @@ class ConsumerMetrics:
                 "end_time": self.end_time.isoformat() if self.end_time else None,
                 "messages": [
                     {
-                        "count": self.message_counts[i],
-                        "publish_time": self.publish_times[i].isoformat(),
-                        "receive_time": self.receive_times[i].isoformat(),
-                        "latency_ms": self.latencies_ms[i],
+                        "count": count,
+                        "publish_time": _from_ns(tx).isoformat(),
+                        "receive_time": _from_ns(rx).isoformat(),
+                        "latency_ms": latency,
                     }
-                    for i in range(len(self.latencies_ms))
+                    for count, tx, rx, latency in zip(
+                        self._counts[:n].tolist(),
+                        self._tx[:n].tolist(),
+                        self._rx[:n].tolist(),
+                        latencies.tolist(),
+                    )
                 ],
                 "summary": {
-                    "avg_latency_ms": statistics.mean(self.latencies_ms)
-                    if self.latencies_ms else 0.0,
-                    "min_latency_ms": min(self.latencies_ms)
-                    if self.latencies_ms else 0.0,
-                    "max_latency_ms": max(self.latencies_ms)
-                    if self.latencies_ms else 0.0,
-                    "p50_latency_ms": self._calculate_percentile(self.latencies_ms, 50),
-                    "p95_latency_ms": self._calculate_percentile(self.latencies_ms, 95),
-                    "p99_latency_ms": self._calculate_percentile(self.latencies_ms, 99),
+                    "avg_latency_ms": float(latencies.mean()) if n else 0.0,
+                    "min_latency_ms": float(sorted_latencies[0]) if n else 0.0,
+                    "max_latency_ms": float(sorted_latencies[-1]) if n else 0.0,
+                    "p50_latency_ms": p50,
+                    "p95_latency_ms": p95,
+                    "p99_latency_ms": p99,
                 },
             }
 
     def record_message(
         self,
-        latency_ms: float,
-        receive_time: datetime,
-        publish_time: datetime,
+        latency_ns: int,
+        receive_ns: int,
+        publish_ns: int,
         message_count: int,
     ) -> None:
-        """Record metrics for a successfully processed message."""
-        with self._lock:
-            if self.start_time is None:
-                self.start_time = receive_time
-            self.messages_received += 1
-            self.latencies_ms.append(latency_ms)
-            self.receive_times.append(receive_time)
-            self.publish_times.append(publish_time)
-            self.message_counts.append(message_count)
+        """Record metrics for a successfully processed message.
+
+        Times are integer nanoseconds since the epoch, as from time.time_ns().
+        """
+        self._samples().append(latency_ns, receive_ns, publish_ns, message_count)
 
     def record_failure(self) -> None:
         """Record a failed message processing attempt."""
-        with self._lock:
-            self.messages_failed += 1
+        self._samples().failed += 1
 
     def finalize(self) -> None:
-        """Mark the end of metrics collection."""
+        """Merge the per-thread samples and mark the end of metrics collection."""
         with self._lock:
             self.end_time = datetime.now(timezone.utc)
-
-    def _calculate_percentile(self, data: list[float], percentile: float) -> float:
-        """Calculate the given percentile of a sorted list."""
-        if not data:
-            return 0.0
-        sorted_data = sorted(data)
-        index = (len(sorted_data) - 1) * percentile / 100
-        lower = int(index)
-        upper = lower + 1
-        if upper >= len(sorted_data):
-            return sorted_data[lower]
+            # Read n before the arrays: a concurrent grow keeps the first n
+            sizes = [(samples, samples.n) for samples in self._thread_samples]
+            rx = np.concatenate([s.rx[:n] for s, n in sizes] or [self._rx])
+            # Samples are grouped by thread; restore arrival order once
+            order = np.argsort(rx, kind="stable")
+            self._rx = rx[order]
+            self._lat = np.concatenate([s.lat[:n] for s, n in sizes] or [self._lat])[order]
+            self._tx = np.concatenate([s.tx[:n] for s, n in sizes] or [self._tx])[order]
+            self._counts = np.concatenate([s.counts[:n] for s, n in sizes] or [self._counts])[order]
+            self._n = len(self._rx)
+            self._failed = sum(samples.failed for samples, _ in sizes)
+            if self._n:
+                self.start_time = _from_ns(self._rx[0])
+
+    def _samples(self) -> _ThreadSamples:
+        """Return the calling thread's buffers, registering them on first use."""
+        try:
+            return self._local.samples
+        except AttributeError:
+            samples = self._local.samples = _ThreadSamples()
+            with self._lock:
+                self._thread_samples.append(samples)
+            return samples
+
+    def _latencies_ms(self) -> np.ndarray:
+        """Return the recorded latencies converted to milliseconds."""
+        return self._lat[: self._n] * 1e-6
+
+    def _calculate_percentiles(
+        self, sorted_data: np.ndarray, percentiles: list[float]
+    ) -> list[float]:
+        """Calculate the given percentiles of sorted data with linear interpolation."""
+        if not len(sorted_data):
+            return [0.0] * len(percentiles)
+        index = (len(sorted_data) - 1) * np.asarray(percentiles, dtype=np.float64) / 100
+        lower = index.astype(np.int64)
+        upper = np.minimum(lower + 1, len(sorted_data) - 1)
         weight = index - lower
-        return sorted_data[lower] * (1 - weight) + sorted_data[upper] * weight
+        return (sorted_data[lower] * (1 - weight) + sorted_data[upper] * weight).tolist()
 
-    def _calculate_inter_arrival_times(self) -> list[float]:
+    def _calculate_inter_arrival_times(self) -> np.ndarray:
         """Calculate time between consecutive message arrivals in ms."""
-        if len(self.receive_times) < 2:
-            return []
-        sorted_times = sorted(self.receive_times)
-        return [
-            (sorted_times[i] - sorted_times[i - 1]).total_seconds() * 1000
-            for i in range(1, len(sorted_times))
-        ]
+        if self._n < 2:
+            return np.empty(0, dtype=np.float64)
+        return np.diff(self._rx[: self._n]).astype(np.float64) * 1e-6
 
     def _count_out_of_order(self) -> int:
         """Count messages received out of order."""
-        if len(self.message_counts) < 2:
+        if self._n < 2:
             return 0
-        out_of_order = 0
-        for i in range(1, len(self.message_counts)):
-            if self.message_counts[i] < self.message_counts[i - 1]:
-                out_of_order += 1
-        return out_of_order
+        # finalize() leaves the samples in arrival order
+        return int(np.count_nonzero(np.diff(self._counts[: self._n]) < 0))
 
     def display_summary(self, consumer_id: str) -> None:
         """Display comprehensive metrics summary."""
@@ -141,11 +249,15 @@ class ConsumerMetrics:
                 success_rate = (self.messages_received / total) * 100
                 print(f"  Success rate:          {success_rate:.2f}%")
 
-            if not self.latencies_ms:
+            n = self._n
+            if not n:
                 print("\n  No messages were successfully processed.")
                 print("=" * 70)
                 return
 
+            latencies = self._latencies_ms()
+            receive_ns = self._rx[:n]
+
             print("\n--- Timing Information ---")
             if self.start_time and self.end_time:
                 duration_sec = (self.end_time - self.start_time).total_seconds()
@@ -157,38 +269,44 @@ class ConsumerMetrics:
                     throughput = self.messages_received / duration_sec
                     print(f"  Throughput:            {throughput:.2f} messages/second")
 
-            if len(self.receive_times) >= 2:
-                sorted_times = sorted(self.receive_times)
-                msg_span = (sorted_times[-1] - sorted_times[0]).total_seconds()
+            if n >= 2:
+                msg_span = (int(receive_ns.max()) - int(receive_ns.min())) / 1e9
                 print(f"  Message span:          {msg_span:.3f} seconds (first to last)")
                 if msg_span > 0:
-                    effective_throughput = (len(self.receive_times) - 1) / msg_span
+                    effective_throughput = (n - 1) / msg_span
                     print(
                         f"  Effective throughput:  {effective_throughput:.2f} messages/second"
                     )
 
             print("\n--- End-to-End Latency (publish -> consumer receive) ---")
-            avg_latency = statistics.mean(self.latencies_ms)
-            print(f"  Min latency:           {min(self.latencies_ms):.3f} ms")
-            print(f"  Max latency:           {max(self.latencies_ms):.3f} ms")
+            # Sort once; min, max and all percentiles are read from it
+            sorted_latencies = np.sort(latencies)
+            min_latency = float(sorted_latencies[0])
+            max_latency = float(sorted_latencies[-1])
+            avg_latency = float(latencies.mean())
+            p50, p90, p95, p99 = self._calculate_percentiles(
+                sorted_latencies, [50, 90, 95, 99]
+            )
+            print(f"  Min latency:           {min_latency:.3f} ms")
+            print(f"  Max latency:           {max_latency:.3f} ms")
             print(f"  Average latency:       {avg_latency:.3f} ms")
-            if len(self.latencies_ms) >= 2:
-                std_latency = statistics.stdev(self.latencies_ms)
+            if n >= 2:
+                std_latency = float(latencies.std(ddof=1))
                 print(f"  Std deviation:         {std_latency:.3f} ms")
 
-            print(f"  Median (p50):          {self._calculate_percentile(self.latencies_ms, 50):.3f} ms")
-            print(f"  p90:                   {self._calculate_percentile(self.latencies_ms, 90):.3f} ms")
-            print(f"  p95:                   {self._calculate_percentile(self.latencies_ms, 95):.3f} ms")
-            print(f"  p99:                   {self._calculate_percentile(self.latencies_ms, 99):.3f} ms")
+            print(f"  Median (p50):          {p50:.3f} ms")
+            print(f"  p90:                   {p90:.3f} ms")
+            print(f"  p95:                   {p95:.3f} ms")
+            print(f"  p99:                   {p99:.3f} ms")
 
             inter_arrival = self._calculate_inter_arrival_times()
-            if inter_arrival:
+            if len(inter_arrival):
                 print("\n--- Inter-Arrival Times (time between consecutive messages) ---")
-                print(f"  Min inter-arrival:     {min(inter_arrival):.3f} ms")
-                print(f"  Max inter-arrival:     {max(inter_arrival):.3f} ms")
-                print(f"  Average inter-arrival: {statistics.mean(inter_arrival):.3f} ms")
+                print(f"  Min inter-arrival:     {inter_arrival.min():.3f} ms")
+                print(f"  Max inter-arrival:     {inter_arrival.max():.3f} ms")
+                print(f"  Average inter-arrival: {inter_arrival.mean():.3f} ms")
                 if len(inter_arrival) >= 2:
-                    print(f"  Std deviation:         {statistics.stdev(inter_arrival):.3f} ms")
+                    print(f"  Std deviation:         {inter_arrival.std(ddof=1):.3f} ms")
 
             out_of_order = self._count_out_of_order()
             print("\n--- Message Ordering ---")
@@ -205,20 +323,43 @@ class ConsumerMetrics:
                 if duration_sec > 0:
                     print(f"  throughput_msg_per_sec={self.messages_received / duration_sec:.3f}")
             print(f"  avg_latency_ms={avg_latency:.3f}")
-            print(f"  min_latency_ms={min(self.latencies_ms):.3f}")
-            print(f"  max_latency_ms={max(self.latencies_ms):.3f}")
-            print(f"  p50_latency_ms={self._calculate_percentile(self.latencies_ms, 50):.3f}")
-            print(f"  p95_latency_ms={self._calculate_percentile(self.latencies_ms, 95):.3f}")
-            print(f"  p99_latency_ms={self._calculate_percentile(self.latencies_ms, 99):.3f}")
+            print(f"  min_latency_ms={min_latency:.3f}")
+            print(f"  max_latency_ms={max_latency:.3f}")
+            print(f"  p50_latency_ms={p50:.3f}")
+            print(f"  p95_latency_ms={p95:.3f}")
+            print(f"  p99_latency_ms={p99:.3f}")
 
             print("=" * 70)
 
 
 
+def report_progress(
+    metrics: ConsumerMetrics,
+    consumer_id: str,
+    interval: float,
+    stop: threading.Event,
+) -> None:
+    """Print a one-line progress summary every interval seconds until stopped.
+
+    Replaces per-message prints, which contend for the stdout lock inside
+    the subscriber's callback threads.
+    """
+    last_received = 0
+    while not stop.wait(interval):
+        received = metrics.messages_received
+        rate = (received - last_received) / interval
+        last_received = received
+        print(
+            f"[{consumer_id}] Received {received} messages "
+            f"({metrics.messages_failed} failed) | {rate:.2f} messages/second"
+        )
+
+
 def run(
     project_id: str,
     subscription_id: str,
     consumer_id: str,
+    report_interval: float,
 ) -> None:
     """Subscribes to Pub/Sub messages and processes them until keyboard interrupt is received"""
     subscriber: pubsub_v1.SubscriberClient = pubsub_v1.SubscriberClient()
@@ -229,38 +370,63 @@ def run(
     print(f"Starting consumer '{consumer_id}' - listening on {subscription_path}")
 
     def callback(message: pubsub_v1.subscriber.message.Message) -> None:
-        received_time: datetime = datetime.now(timezone.utc)
+        received_ns: int = time.time_ns()
 
         try:
-            data: dict = json.loads(message.data.decode("utf-8"))
-            message_timestamp: datetime = datetime.fromisoformat(data["timestamp"])
-            latency_ms: float = (received_time - message_timestamp).total_seconds() * 1000
+            attributes = message.attributes
+            if "count" in attributes:
+                # Current producers send the fields as attributes
+                publish_ns: int = int(attributes["timestamp_ns"])
+                message_count: int = int(attributes["count"])
+            else:
+                data: dict = orjson.loads(message.data)
+                if "timestamp_ns" in data:
+                    publish_ns = data["timestamp_ns"]
+                else:
+                    # Older producers only send the ISO timestamp
+                    publish_ns = _to_ns(datetime.fromisoformat(data["timestamp"]))
+                message_count = data["count"]
+            latency_ns: int = received_ns - publish_ns
 
             # Slow processing simulation
             if consumer_id == "slow-consumer":
                 time.sleep(0.1) 
             # Record metrics
             metrics.record_message(
-                latency_ms=latency_ms,
-                receive_time=received_time,
-                publish_time=message_timestamp,
-                message_count=data["count"],
+                latency_ns=latency_ns,
+                receive_ns=received_ns,
+                publish_ns=publish_ns,
+                message_count=message_count,
             )
-
-            print(
-                f"[{consumer_id}] Received message #{data['count']} "
-                f"from '{data['source']}' | Latency: {latency_ms:.2f} ms"
-            )
-        except (json.JSONDecodeError, KeyError) as e:
+        # orjson.JSONDecodeError is a ValueError, as is a malformed attribute
+        except (KeyError, ValueError) as e:
             metrics.record_failure()
             print(f"[{consumer_id}] Error processing message: {e}")
 
         message.ack()
 
+    stop_reporting = threading.Event()
+    reporter = threading.Thread(
+        target=report_progress,
+        args=(metrics, consumer_id, report_interval, stop_reporting),
+        daemon=True,
+    )
+
+    # A wider callback pool on multi-core machines. Flow control keeps the
+    # client default: consumers share one subscription, and a larger lease
+    # window would let a slow consumer hold back messages from the others
+    scheduler = pubsub_v1.subscriber.scheduler.ThreadScheduler(
+        executor=ThreadPoolExecutor(max_workers=CALLBACK_WORKERS)
+    )
+
     streaming_pull_future = subscriber.subscribe(
         subscription_path,
         callback=callback,
+        scheduler=scheduler,
+        # cancel() waits for running callbacks, so none record after finalize()
+        await_callbacks_on_shutdown=True,
     )
+    reporter.start()
     print(f"Consumer '{consumer_id}' is now listening for messages...")
 
     try:
@@ -268,6 +434,7 @@ def run(
     except KeyboardInterrupt:
         streaming_pull_future.cancel()
         streaming_pull_future.result()
+        stop_reporting.set()
         metrics.finalize()
         print(f"\nConsumer '{consumer_id}' stopped.")
         metrics.display_summary(consumer_id)
@@ -301,6 +468,12 @@ def main() -> None:
         default=DEFAULT_CONSUMER_ID,
         help=f"Identity of the consumer (default: {DEFAULT_CONSUMER_ID})",
     )
+    parser.add_argument(
+        "--report-interval",
+        type=float,
+        default=DEFAULT_REPORT_INTERVAL,
+        help=f"Seconds between progress summaries (default: {DEFAULT_REPORT_INTERVAL})",
+    )
 
     args: argparse.Namespace = parser.parse_args()
 
@@ -308,6 +481,7 @@ def main() -> None:
         project_id=args.project_id,
         subscription_id=args.subscription_id,
         consumer_id=args.consumer_id,
+        report_interval=args.report_interval,
     )
 
 
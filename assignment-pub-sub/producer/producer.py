@@ -1,45 +1,348 @@
 import argparse
+import itertools
 import json
+import math
+import os
+import sys
+import threading
 import time
-from datetime import datetime, timezone
+from collections.abc import Callable, Iterator, Sequence
+from typing import Any
+from concurrent import futures
+from dataclasses import dataclass, field
+from functools import partial
 
+import grpc
 from google.cloud import pubsub_v1
+from google.pubsub_v1.services.publisher.transports import PublisherGrpcTransport
 
 DEFAULT_PROJECT_ID: str = "networkedapps-danila-2026"
 DEFAULT_TOPIC_ID: str = "pub-sub-task-1"
 DEFAULT_PRODUCER_ID: str = "producer-1"
-DEFAULT_PUBLISH_INTERVAL: int = 1
+DEFAULT_PUBLISH_INTERVAL: float = 1.0
+DEFAULT_REPORT_INTERVAL: float = 5.0
+DEFAULT_CHANNELS: int = 4
+DEFAULT_WORKERS: int = 1
+DEFAULT_PROFILE: str = "latency"
 
+# How long to wait for the pool's channels to connect before publishing
+WARMUP_TIMEOUT: float = 10.0
 
-def run(
-    project_id: str,
-    topic_id: str,
+# Batching presets, selectable with --profile:
+# - latency (default): every message is sent in its own RPC as soon as it is
+#   published, so batching adds nothing to the measured end-to-end latency
+# - throughput: larger, less frequent Publish RPCs than the client defaults
+#   (100 messages, 1 MB, 10 ms) for high publish rates; a message can wait up
+#   to 50 ms for its batch. max_bytes stays under the 10 MB request limit
+BATCH_PROFILES: dict[str, dict[str, int | float]] = {
+    "throughput": {"max_bytes": 9 * 1024 * 1024, "max_messages": 1000, "max_latency": 0.05},
+    "latency": {"max_bytes": 1, "max_messages": 1, "max_latency": 0.0},
+}
+
+# Upper bound on publishes in flight across the whole pool; publish() blocks
+# once it is reached, so memory stays bounded if Pub/Sub falls behind
+FLOW_CONTROL_MAX_MESSAGES: int = 10_000
+FLOW_CONTROL_MAX_BYTES: int = 100 * 1024 * 1024
+
+
+@dataclass
+class PublishStats:
+    """Thread-safe publish outcome counters, updated from future callbacks."""
+
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    published: int = 0
+    failed: int = 0
+
+    # Print every published message ID, not just the periodic summary
+    verbose: bool = False
+
+    # Futures whose publish has not completed yet
+    _pending: set[pubsub_v1.publisher.futures.Future] = field(
+        default_factory=set, repr=False
+    )
+
+    def track(self, future: pubsub_v1.publisher.futures.Future, count: int) -> None:
+        """Count the outcome of a publish once its future completes."""
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(partial(self._on_done, count))
+
+    def pending(self) -> list[pubsub_v1.publisher.futures.Future]:
+        """Return the futures that are still in flight."""
+        with self._lock:
+            return list(self._pending)
+
+    def _on_done(self, count: int, future: pubsub_v1.publisher.futures.Future) -> None:
+        # Runs on the publisher's threads; any exception means the publish failed
+        error: BaseException | None = future.exception()
+        with self._lock:
+            self._pending.discard(future)
+            if error is None:
+                self.published += 1
+            else:
+                self.failed += 1
+        if error is not None:
+            print(f"Failed to publish message {count}: {error}")
+        elif self.verbose:
+            print(f"Published message {count} with ID: {future.result()}")
+
+
+# gRPC otherwise shares subchannels between channels to the same target,
+# which would put every client of a pool back on one TCP connection
+_LOCAL_SUBCHANNEL_POOL: tuple[str, int] = ("grpc.use_local_subchannel_pool", 1)
+
+
+def _create_channel(
+    *args: Any, options: Sequence[tuple[str, Any]] = (), **kwargs: Any
+) -> grpc.Channel:
+    """Create a transport channel with its own subchannel pool."""
+    return PublisherGrpcTransport.create_channel(
+        *args, options=[*options, _LOCAL_SUBCHANNEL_POOL], **kwargs
+    )
+
+
+def _create_transport() -> PublisherGrpcTransport:
+    """Create a transport on a channel of its own.
+
+    PublisherClient only applies PUBSUB_EMULATOR_HOST when it builds the
+    transport itself, so the emulator is handled here as well.
+    """
+    emulator_host: str | None = os.environ.get("PUBSUB_EMULATOR_HOST")
+    if emulator_host:
+        # A ready-made channel is used without credentials, as the emulator expects
+        channel = grpc.insecure_channel(emulator_host, options=[_LOCAL_SUBCHANNEL_POOL])
+        return PublisherGrpcTransport(host=emulator_host, channel=channel)
+    return PublisherGrpcTransport(channel=_create_channel)
+
+
+class PublisherPool:
+    """Round-robins publishes over several clients, one gRPC channel each.
+
+    Spreading publishes over independent HTTP/2 connections avoids
+    head-of-line blocking on a single connection's flow-control window.
+    """
+
+    def __init__(self, size: int, batch_settings: pubsub_v1.types.BatchSettings) -> None:
+        # Split the flow-control budget so the pool as a whole honours it
+        publisher_options = pubsub_v1.types.PublisherOptions(
+            flow_control=pubsub_v1.types.PublishFlowControl(
+                message_limit=max(1, FLOW_CONTROL_MAX_MESSAGES // size),
+                byte_limit=max(batch_settings.max_bytes, FLOW_CONTROL_MAX_BYTES // size),
+                limit_exceeded_behavior=pubsub_v1.types.LimitExceededBehavior.BLOCK,
+            )
+        )
+        self.clients: list[pubsub_v1.PublisherClient] = [
+            pubsub_v1.PublisherClient(
+                batch_settings=batch_settings,
+                publisher_options=publisher_options,
+                transport=_create_transport(),
+            )
+            for _ in range(size)
+        ]
+        self._next_client = itertools.cycle(self.clients).__next__
+
+    def warm_up(self, timeout: float) -> bool:
+        """Connect every channel up front, returning False on timeout.
+
+        Channels otherwise connect lazily, which puts the TCP, TLS and HTTP/2
+        handshakes on the first batch each client sends.
+        """
+        ready = [
+            grpc.channel_ready_future(client.transport.grpc_channel)
+            for client in self.clients
+        ]
+        # futures.wait would reject these: grpc futures are not
+        # concurrent.futures.Future instances
+        deadline: float = time.monotonic() + timeout
+        try:
+            for future in ready:
+                future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except grpc.FutureTimeoutError:
+            for future in ready:
+                future.cancel()
+            return False
+        return True
+
+    def topic_path(self, project_id: str, topic_id: str) -> str:
+        return self.clients[0].topic_path(project_id, topic_id)
+
+    def publish(
+        self, topic: str, data: bytes, **attrs: str
+    ) -> pubsub_v1.publisher.futures.Future:
+        return self._next_client().publish(topic, data, **attrs)
+
+    def stop(self) -> None:
+        for client in self.clients:
+            client.stop()
+
+
+def _publish_loop(
+    publisher: PublisherPool,
+    topic_path: str,
     producer_id: str,
-    publish_interval: int,
+    counter: Iterator[int],
+    stats: PublishStats,
+    publish_interval: float,
+    num_messages: int | None,
+    stop: threading.Event,
 ) -> None:
-    """Publishes messages to Pub/Sub indefinitely."""
-    publisher: pubsub_v1.PublisherClient = pubsub_v1.PublisherClient()
-    topic_path: str = publisher.topic_path(project_id, topic_id)
+    """Publishes one message per interval until stop is set or the limit is hit."""
+    # Sleep until a fixed schedule rather than for a fixed time, so the time
+    # spent building and publishing a message does not lower the rate
+    next_deadline: float = time.monotonic()
 
-    count: int = 1
+    while not stop.is_set():
+        # Counts are shared by all loops; next() on a count is atomic
+        count: int = next(counter)
+        if num_messages is not None and count > num_messages:
+            break
+        # The fields travel as message attributes with an empty body, so
+        # nothing is serialized to JSON on either side. Outcomes are
+        # counted by a done callback, so the loop never waits on a
+        # publish round-trip
+        future = publisher.publish(
+            topic_path,
+            b"",
+            source=producer_id,
+            timestamp_ns=str(time.time_ns()),
+            count=str(count),
+        )
+        stats.track(future, count)
+
+        next_deadline += publish_interval
+        sleep_for: float = next_deadline - time.monotonic()
+        if sleep_for > 0:
+            stop.wait(sleep_for)
+
+
+def run(
+    publisher: PublisherPool,
+    topic_path: str,
+    producer_id: str,
+    publish_interval: float,
+    report_interval: float,
+    workers: int,
+    num_messages: int | None,
+    verbose: bool,
+) -> None:
+    """Publishes messages to Pub/Sub until the limit is hit or keyboard interrupt is received"""
+    counter: Iterator[int] = itertools.count(1)
+    stats = PublishStats(verbose=verbose)
 
     print(f"Starting producer '{producer_id}' - publishing to {topic_path}")
 
-    while True:
-        message: dict[str, str | int] = {
-            "source": producer_id,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "count": count,
-        }
+    # Each worker runs its own paced loop against the shared, thread-safe
+    # pool, whose batchers coalesce messages from all of them
+    stop = threading.Event()
+    executor = futures.ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="publish"
+    )
+    loops: list[futures.Future] = [
+        executor.submit(
+            _publish_loop,
+            publisher, topic_path, producer_id, counter, stats, publish_interval,
+            num_messages, stop,
+        )
+        for _ in range(workers)
+    ]
+
+    try:
+        while True:
+            # Report counts periodically instead of printing every message ID
+            done, running = futures.wait(
+                loops, timeout=report_interval, return_when=futures.FIRST_EXCEPTION
+            )
+            # Surface the error of any loop that raised
+            for loop in done:
+                loop.result()
+            if not running:
+                break
+            print(
+                f"[{producer_id}] Published {stats.published} messages "
+                f"({stats.failed} failed)"
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Stop the loops and wait for the in-flight publishes; the pool stays
+        # open so a daemon can reuse it for the next run
+        stop.set()
+        executor.shutdown()
+        futures.wait(stats.pending())
+
+    print(
+        f"\nProducer '{producer_id}' stopped. "
+        f"Published {stats.published} messages ({stats.failed} failed)"
+    )
+
+
+def _is_int(value: object) -> bool:
+    # bool is an int subclass, but true is not a valid worker count
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_seconds(value: object) -> bool:
+    # json.loads accepts Infinity and NaN, and waits overflow past TIMEOUT_MAX
+    return (
+        (_is_int(value) or isinstance(value, float))
+        and math.isfinite(value)
+        and value <= threading.TIMEOUT_MAX
+    )
+
+
+def _is_positive_int(value: object) -> bool:
+    return _is_int(value) and value >= 1
+
+
+# Accepted values of each option a daemon run request may override
+RUN_OPTION_CHECKS: dict[str, Callable[[object], bool]] = {
+    "producer_id": lambda value: isinstance(value, str),
+    "publish_interval": lambda value: _is_seconds(value) and value >= 0,
+    "report_interval": lambda value: _is_seconds(value) and value > 0,
+    "workers": _is_positive_int,
+    "num_messages": lambda value: value is None or (_is_int(value) and value >= 0),
+    "verbose": lambda value: isinstance(value, bool),
+}
+
 
-        message_bytes: bytes = json.dumps(message).encode("utf-8")
-        future = publisher.publish(topic_path, message_bytes)
-        message_id: str = future.result()
+def _checked_type(
+    parse: Callable[[str], Any], check: Callable[[object], bool]
+) -> Callable[[str], Any]:
+    """Wrap an argparse type so the CLI accepts the same values as the daemon."""
+    def convert(text: str) -> Any:
+        value = parse(text)
+        if not check(value):
+            raise argparse.ArgumentTypeError(f"invalid value: {text!r}")
+        return value
 
-        print(f"Published message {count} with ID: {message_id}")
+    # argparse names the type in its "invalid int value" messages
+    convert.__name__ = parse.__name__
+    return convert
 
-        count += 1
-        time.sleep(publish_interval)
+
+def serve(publisher: PublisherPool, topic_path: str, defaults: dict) -> None:
+    """Performs one run per JSON line read from stdin, reusing the same pool.
+
+    Each line overrides some of the run options given on the command line,
+    e.g. {"num_messages": 1000, "publish_interval": 0.001}.
+    """
+    print(f"Daemon ready - reading runs from stdin, options: {', '.join(defaults)}")
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            print(f"Invalid run request: {e}")
+            continue
+        if not isinstance(request, dict) or not all(
+            name in RUN_OPTION_CHECKS and RUN_OPTION_CHECKS[name](value)
+            for name, value in request.items()
+        ):
+            print(f"Invalid run request: {line.strip()}")
+            continue
+        run(publisher, topic_path, **{**defaults, **request})
 
 
 def main() -> None:
@@ -66,19 +369,105 @@ def main() -> None:
     )
     parser.add_argument(
         "--publish-interval",
-        type=int,
+        type=_checked_type(float, RUN_OPTION_CHECKS["publish_interval"]),
         default=DEFAULT_PUBLISH_INTERVAL,
         help=f"Interval between messages in seconds (default: {DEFAULT_PUBLISH_INTERVAL})",
     )
+    parser.add_argument(
+        "--report-interval",
+        type=_checked_type(float, RUN_OPTION_CHECKS["report_interval"]),
+        default=DEFAULT_REPORT_INTERVAL,
+        help=f"Seconds between progress summaries (default: {DEFAULT_REPORT_INTERVAL})",
+    )
+    parser.add_argument(
+        "--channels",
+        type=_checked_type(int, _is_positive_int),
+        default=DEFAULT_CHANNELS,
+        help=f"Number of gRPC channels to publish over (default: {DEFAULT_CHANNELS})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=_checked_type(int, RUN_OPTION_CHECKS["workers"]),
+        default=DEFAULT_WORKERS,
+        help=f"Number of threads publishing concurrently, each at --publish-interval (default: {DEFAULT_WORKERS})",
+    )
+    parser.add_argument(
+        "--num-messages",
+        type=_checked_type(int, RUN_OPTION_CHECKS["num_messages"]),
+        help="Stop after publishing this many messages (default: run until interrupted)",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep the connections open and perform one run per JSON line read from stdin",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=sorted(BATCH_PROFILES),
+        default=DEFAULT_PROFILE,
+        help=f"Batching preset the --max-* options default to (default: {DEFAULT_PROFILE})",
+    )
+    parser.add_argument(
+        "--max-bytes",
+        type=int,
+        help="Publish a batch once it reaches this many bytes",
+    )
+    parser.add_argument(
+        "--max-messages",
+        type=int,
+        help="Publish a batch once it holds this many messages",
+    )
+    parser.add_argument(
+        "--max-latency",
+        type=float,
+        help="Publish a batch at most this many seconds after its first message",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Print the ID of every published message",
+    )
 
     args: argparse.Namespace = parser.parse_args()
 
-    run(
-        project_id=args.project_id,
-        topic_id=args.topic_id,
-        producer_id=args.producer_id,
-        publish_interval=args.publish_interval,
+    # Explicit --max-* options override the selected profile
+    batch_options: dict[str, int | float] = {
+        **BATCH_PROFILES[args.profile],
+        **{
+            name: value
+            for name in ("max_bytes", "max_messages", "max_latency")
+            if (value := getattr(args, name)) is not None
+        },
+    }
+
+    # Built once so that daemon runs share the clients and their connections
+    publisher = PublisherPool(
+        size=args.channels,
+        batch_settings=pubsub_v1.types.BatchSettings(**batch_options),
     )
+    topic_path: str = publisher.topic_path(args.project_id, args.topic_id)
+
+    if not publisher.warm_up(WARMUP_TIMEOUT):
+        print(f"Channels not ready after {WARMUP_TIMEOUT}s, connecting on first publish")
+
+    run_options: dict = {
+        "producer_id": args.producer_id,
+        "publish_interval": args.publish_interval,
+        "report_interval": args.report_interval,
+        "workers": args.workers,
+        "num_messages": args.num_messages,
+        "verbose": args.verbose,
+    }
+
+    try:
+        if args.daemon:
+            serve(publisher, topic_path, run_options)
+        else:
+            run(publisher, topic_path, **run_options)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        publisher.stop()
 
 
 if __name__ == "__main__":